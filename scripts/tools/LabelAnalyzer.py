@@ -1,126 +1,392 @@
-import json
+"""Analyze the structure and HTML content of FDA drug label JSON files.
+
+Requires lxml and orjson; ijson is additionally needed to stream files
+larger than 500 MB:
+
+    pip install lxml orjson ijson
+"""
+import csv
+import os
 import re
-from bs4 import BeautifulSoup
-from typing import Dict, List, Any, Set
-import pandas as pd
-from collections import defaultdict
+import sys
+import orjson
+from lxml import etree
+from typing import Dict, Iterator, List, Any, Optional, Set
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+
+# Files above this size are streamed item by item instead of loaded whole
+_STREAMING_THRESHOLD = 500 * 1024 * 1024
+
+# Smaller corpora are analyzed serially; process startup would dominate
+_PARALLEL_MIN_DRUGS = 200
+
+# Drugs sent to a worker process per task
+_BATCH_SIZE = 50
+
+# Leading array items inspected for additional object shapes
+_ARRAY_SAMPLE_ITEMS = 8
+
+# Samples kept per field in the report
+_MAX_SAMPLES = 3
+_HTML_SAMPLE_PREFIX = '[HTML] '
+_PREVIEW_LENGTH = 200
+# Elements whose text is code rather than label content
+_NON_TEXT_TAGS = frozenset({'script', 'style'})
+
+_HTML_RE = re.compile(r'<[^>]+>')
+
+# Fragments with fewer opening tags than this, where every '<' starts a plain
+# open or close tag of an element lxml keeps in place wherever it appears,
+# are summarized from the tag names alone without parsing
+_FAST_PATH_MAX_TAGS = 4
+_SIMPLE_TAG_RE = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9]*)(?:\s[^<>]*)?/?>')
+_SECTION_CODE_RE = re.compile(r'data-sectioncode', re.IGNORECASE)
+_FAST_PATH_TAGS = frozenset({
+    'a', 'abbr', 'b', 'big', 'br', 'cite', 'code', 'div', 'em', 'font', 'i',
+    'img', 'p', 's', 'small', 'span', 'strike', 'strong', 'sub', 'sup', 'tt',
+    'u', 'var',
+})
+
+# Field paths that point at key medical sections
+_KEY_SECTION_RE = re.compile(r'indication|dosage|warning|adverse|clinical', re.IGNORECASE)
+
+# One parser per process, reused for every fragment. It lives at module level
+# because analyzers are pickled back from worker processes and lxml parsers
+# cannot be. Comments and processing instructions are never inspected.
+_HTML_PARSER = etree.HTMLParser(recover=True, remove_comments=True, remove_pis=True)
+# lxml rejects str input that carries an XML encoding declaration; those
+# fragments are re-parsed from UTF-8 bytes instead
+_HTML_BYTES_PARSER = etree.HTMLParser(
+    encoding='utf-8', recover=True, remove_comments=True, remove_pis=True
+)
+
+# Wrapper elements lxml adds around label fragments; only those the label
+# does not spell out itself are left out of the tag inventory
+_WRAPPER_TAGS = frozenset({'html', 'head', 'body'})
+_WRAPPER_TAG_RE = re.compile(r'<(html|head|body)[\s/>]', re.IGNORECASE)
+# Source regions where a wrapper-looking tag is not markup
+_NON_MARKUP_RE = re.compile(
+    r'<!--.*?(?:-->|\Z)|<(script|style)\b.*?(?:</\1\s*>|\Z)', re.IGNORECASE | re.DOTALL
+)
 
 class FDALabelAnalyzer:
     """Analyzes FDA drug label JSON files to understand structure and content"""
     
     def __init__(self):
-        self.field_stats = defaultdict(lambda: {
-            'count': 0,
-            'sample_values': [],
-            'html_tags': set(),
-            'max_length': 0,
-            'has_tables': False,
-            'has_lists': False,
-            'section_codes': set()
-        })
-        
-    def analyze_json_file(self, file_path: str) -> Dict[str, Any]:
+        # Per-field statistics stored column-wise, keyed by field path;
+        # the HTML columns are only populated for fields that contain HTML
+        self.counts: Dict[str, int] = {}
+        self.max_lengths: Dict[str, int] = {}
+        self.sample_values: Dict[str, List[str]] = {}
+        # Fields whose first sample is an HTML text preview
+        self.html_previews: Set[str] = set()
+        self.html_tags: Dict[str, Set[str]] = {}
+        self.section_codes: Dict[str, Set[str]] = {}
+        self.has_tables: Set[str] = set()
+        self.has_lists: Set[str] = set()
+        
+        # Structure tree built during the walk; leaves are filled at report time
+        self.tree: Dict[str, Any] = {}
+        self.tree_leaves: Dict[str, Dict[str, Any]] = {}
+        
+    def analyze_json_file(self, file_path: str, workers: Optional[int] = None) -> Dict[str, Any]:
         """Analyze a single JSON file or array of drug labels"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        print(f"Analyzing drug labels from {file_path}")
         
-        # Handle both single object and array
-        drugs = data if isinstance(data, list) else [data]
+        workers = workers or os.cpu_count() or 1
+        drugs = self._iter_drugs(file_path)
+        head = list(islice(drugs, _PARALLEL_MIN_DRUGS))
         
-        print(f"Analyzing {len(drugs)} drug(s) from {file_path}")
+        if workers == 1 or len(head) < _PARALLEL_MIN_DRUGS:
+            drug_count = 0
+            for drug in chain(head, drugs):
+                self._analyze_drug(drug)
+                drug_count += 1
+        else:
+            drug_count = self._analyze_parallel(chain(head, drugs), workers)
         
-        for drug in drugs:
-            self._analyze_drug(drug)
+        print(f"Analyzed {drug_count} drug(s)")
         
         return self._generate_report()
     
+    def _analyze_parallel(self, drugs: Iterator[Dict[str, Any]], workers: int) -> int:
+        """Analyze drugs in batches across worker processes, merging results in order"""
+        drug_count = 0
+        pending = deque()
+        
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while True:
+                batch = list(islice(drugs, _BATCH_SIZE))
+                if batch:
+                    drug_count += len(batch)
+                    pending.append(pool.submit(_analyze_batch, batch))
+                
+                # Bound in-flight batches so streamed input is not read ahead
+                while pending and (not batch or len(pending) >= 2 * workers):
+                    self._merge(pending.popleft().result())
+                
+                if not batch:
+                    break
+        
+        return drug_count
+    
+    def _merge(self, other: 'FDALabelAnalyzer'):
+        """Fold another analyzer's field statistics into this one"""
+        for field, count in other.counts.items():
+            self.counts[field] = self.counts.get(field, 0) + count
+        
+        for field, length in other.max_lengths.items():
+            if length > self.max_lengths.get(field, 0):
+                self.max_lengths[field] = length
+        
+        # Replay the same caps _analyze_drug applies: an HTML preview (always
+        # first in its list) only fills an empty slot, other samples fill up
+        # to _MAX_SAMPLES
+        for field, samples in other.sample_values.items():
+            merged = self.sample_values.setdefault(field, [])
+            if field in other.html_previews:
+                if not merged:
+                    merged.append(samples[0])
+                    self.html_previews.add(field)
+                samples = samples[1:]
+            merged.extend(samples[:_MAX_SAMPLES - len(merged)])
+        
+        for field, tags in other.html_tags.items():
+            self.html_tags.setdefault(field, set()).update(tags)
+        for field, codes in other.section_codes.items():
+            self.section_codes.setdefault(field, set()).update(codes)
+        
+        self.has_tables |= other.has_tables
+        self.has_lists |= other.has_lists
+        
+        # Place newly seen fields in this analyzer's own tree, in the order
+        # a serial run would have first met them
+        for field in other.tree_leaves:
+            if field not in self.tree_leaves:
+                self._add_tree_leaf(field)
+    
+    def _iter_drugs(self, file_path: str) -> Iterator[Dict[str, Any]]:
+        """Yield drug labels from a JSON file, streaming very large files"""
+        if os.path.getsize(file_path) < _STREAMING_THRESHOLD:
+            with open(file_path, 'rb') as f:
+                data = orjson.loads(f.read())
+            
+            # Handle both single object and array
+            yield from (data if isinstance(data, list) else [data])
+            return
+        
+        # Only needed for very large files, so imported on demand
+        import ijson
+        
+        with open(file_path, 'rb') as f:
+            # Stream array items, or the whole document if it is a single object
+            prefix = 'item' if f.read(1024).lstrip().startswith(b'[') else ''
+            f.seek(0)
+            yield from ijson.items(f, prefix, use_float=True)
+    
     def _analyze_drug(self, drug: Dict[str, Any], prefix: str = ''):
         """Recursively analyze drug data structure"""
+        # Decoded JSON only holds exact built-in types, so dispatch on type()
+        # and keep the stats columns in locals for the hot loop
+        counts = self.counts
+        max_lengths = self.max_lengths
+        sample_values = self.sample_values
         for key, value in drug.items():
-            field_key = f"{prefix}{key}" if prefix else key
+            # Interned so repeat lookups across drugs hit the identity fast path
+            field_key = sys.intern(f"{prefix}{key}" if prefix else key)
+            value_type = type(value)
             
-            if isinstance(value, dict):
+            if value_type is dict:
                 # Nested object - recurse
                 self._analyze_drug(value, f"{field_key}.")
-            elif isinstance(value, list):
+                continue
+            
+            count = counts.get(field_key, 0)
+            counts[field_key] = count + 1
+            if not count:
+                # First occurrence - place the field's leaf in the tree
+                self._add_tree_leaf(field_key)
+            samples = sample_values.get(field_key)
+            if samples is None:
+                samples = sample_values[field_key] = []
+            
+            if value_type is list:
                 # Array field
-                self.field_stats[field_key]['count'] += 1
-                self.field_stats[field_key]['sample_values'].append(f"[Array with {len(value)} items]")
-                # Analyze first item if exists
-                if value and isinstance(value[0], dict):
-                    self._analyze_drug(value[0], f"{field_key}[0].")
-            elif isinstance(value, str):
+                if len(samples) < _MAX_SAMPLES:
+                    samples.append(f"[Array with {len(value)} items]")
+                # Analyze the leading items, folded into one record
+                if value and type(value[0]) is dict:
+                    item = self._merge_item_shapes(value)
+                    self._analyze_drug(item, f"{field_key}[0].")
+            elif value_type is str:
                 # String field - check if HTML
-                self.field_stats[field_key]['count'] += 1
-                self.field_stats[field_key]['max_length'] = max(
-                    self.field_stats[field_key]['max_length'], 
-                    len(value)
-                )
+                length = len(value)
+                if length > max_lengths.get(field_key, 0):
+                    max_lengths[field_key] = length
                 
                 if self._is_html(value):
-                    self._analyze_html_content(field_key, value)
-                else:
+                    self._analyze_html_content(field_key, value, samples)
+                elif len(samples) < _MAX_SAMPLES:
                     # Regular string - store sample
-                    if len(self.field_stats[field_key]['sample_values']) < 3:
-                        sample = value[:100] + "..." if len(value) > 100 else value
-                        self.field_stats[field_key]['sample_values'].append(sample)
-            else:
+                    samples.append(value[:100] + "..." if length > 100 else value)
+            elif len(samples) < _MAX_SAMPLES:
                 # Other types (numbers, booleans, etc.)
-                self.field_stats[field_key]['count'] += 1
-                if len(self.field_stats[field_key]['sample_values']) < 3:
-                    self.field_stats[field_key]['sample_values'].append(str(value))
+                samples.append(str(value))
+    
+    def _merge_item_shapes(self, items: List[Any]) -> Dict[str, Any]:
+        """Fold the distinct object shapes among an array's leading items into one record"""
+        first = items[0]
+        seen_keys = [first.keys()]
+        merged = first
+        for item in islice(items, 1, _ARRAY_SAMPLE_ITEMS):
+            if type(item) is not dict:
+                continue
+            keys = item.keys()
+            # Homogeneous arrays stop here; key views compare as sets
+            if any(keys == seen for seen in seen_keys):
+                continue
+            seen_keys.append(keys)
+            if merged is first:
+                merged = dict(first)
+            for key, value in item.items():
+                if key not in merged:
+                    merged[key] = value
+        return merged
+    
+    def _add_tree_leaf(self, field_key: str):
+        """Place a field's leaf in the structure tree, creating its branches"""
+        # Split the full path so dotted JSON keys nest like any other level;
+        # branches only exist on the way to a leaf, so empty objects leave no trace
+        parts = field_key.split('.')
+        node = self.tree
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        self.tree_leaves[field_key] = node.setdefault(parts[-1], {})
     
     def _is_html(self, text: str) -> bool:
         """Check if string contains HTML"""
-        return bool(re.search(r'<[^>]+>', text))
+        lt = text.find('<')
+        if lt < 0:
+            return False
+        gt = text.find('>', lt + 1)
+        if gt < 0:
+            return False
+        if gt > lt + 1:
+            return True
+        # Only an empty '<>' so far - let the regex check the rest
+        return _HTML_RE.search(text, gt) is not None
     
-    def _analyze_html_content(self, field_key: str, html: str):
+    def _analyze_html_content(self, field_key: str, html: str, samples: List[str]):
         """Analyze HTML content for structure and elements"""
-        soup = BeautifulSoup(html, 'html.parser')
-        
-        # Store a text preview
-        text_content = soup.get_text(strip=True)[:200]
-        if len(self.field_stats[field_key]['sample_values']) < 1:
-            self.field_stats[field_key]['sample_values'].append(f"[HTML] {text_content}...")
+        # Trivial fragments (a stray <br> or <b>) only contribute tag names, so
+        # skip building a tree once the field's preview has been stored.
+        # Anything lxml might interpret differently (comments, declarations,
+        # stray '<', raw-text elements) takes the full parse below.
+        if samples and html.count('<') <= 2 * _FAST_PATH_MAX_TAGS:
+            matches = _SIMPLE_TAG_RE.findall(html)
+            if len(matches) == html.count('<'):
+                names = {name.lower() for _, name in matches}
+                tag_names = [name.lower() for closing, name in matches if not closing]
+                if (len(tag_names) < _FAST_PATH_MAX_TAGS
+                        and names <= _FAST_PATH_TAGS
+                        and _SECTION_CODE_RE.search(html) is None):
+                    if tag_names:
+                        self.html_tags.setdefault(field_key, set()).update(map(sys.intern, tag_names))
+                    return
         
-        # Collect HTML tags used
-        for tag in soup.find_all():
-            self.field_stats[field_key]['html_tags'].add(tag.name)
+        try:
+            root = etree.fromstring(html, _HTML_PARSER)
+        except ValueError:
+            root = etree.fromstring(html.encode('utf-8'), _HTML_BYTES_PARSER)
+        if root is None:
+            # Nothing but a comment, doctype or stray close tag; it still
+            # takes the field's preview slot, with no text
+            if not samples:
+                samples.append(f"{_HTML_SAMPLE_PREFIX}...")
+                self.html_previews.add(field_key)
+            return
         
-        # Check for tables
-        if soup.find('table'):
-            self.field_stats[field_key]['has_tables'] = True
+        # Store a text preview, reading only as much text as it needs
+        if not samples:
+            parts = []
+            total = 0
+            # Walk start/end events to keep document order: an element's text
+            # precedes its children, its tail follows them
+            for event, element in etree.iterwalk(root, events=('start', 'end')):
+                if event == 'start':
+                    text = None if element.tag in _NON_TEXT_TAGS else element.text
+                else:
+                    text = element.tail
+                if not text:
+                    continue
+                text = text.strip()
+                parts.append(text)
+                total += len(text)
+                if total >= _PREVIEW_LENGTH:
+                    break
+            text_content = ''.join(parts)[:_PREVIEW_LENGTH]
+            samples.append(f"{_HTML_SAMPLE_PREFIX}{text_content}...")
+            self.html_previews.add(field_key)
         
-        # Check for lists
-        if soup.find(['ul', 'ol']):
-            self.field_stats[field_key]['has_lists'] = True
+        # Collect tags, tables, lists and section codes in one pass
+        implied_tags = _WRAPPER_TAGS.difference(self._written_wrapper_tags(html))
+        tags = set()
+        section_codes = set()
+        has_tables = has_lists = False
+        for element in root.iter(etree.Element):
+            tag = element.tag
+            if tag in implied_tags:
+                continue
+            tags.add(tag)
+            if tag == 'table':
+                has_tables = True
+            elif tag == 'ul' or tag == 'ol':
+                has_lists = True
+            section_code = element.get('data-sectioncode')
+            if section_code is not None:
+                section_codes.add(section_code)
         
-        # Extract section codes
-        sections = soup.find_all(attrs={'data-sectioncode': True})
-        for section in sections:
-            self.field_stats[field_key]['section_codes'].add(section.get('data-sectioncode'))
+        if tags:
+            self.html_tags.setdefault(field_key, set()).update(map(sys.intern, tags))
+        if section_codes:
+            self.section_codes.setdefault(field_key, set()).update(section_codes)
+        if has_tables:
+            self.has_tables.add(field_key)
+        if has_lists:
+            self.has_lists.add(field_key)
+    
+    def _written_wrapper_tags(self, html: str) -> Set[str]:
+        """Return the html/head/body tags a fragment spells out as real markup"""
+        written = {tag.lower() for tag in _WRAPPER_TAG_RE.findall(html)}
+        # Rare case: discount matches inside comments or script/style text
+        if written and _NON_MARKUP_RE.search(html):
+            written = {tag.lower() for tag in _WRAPPER_TAG_RE.findall(_NON_MARKUP_RE.sub('', html))}
+        return written
     
     def _generate_report(self) -> Dict[str, Any]:
         """Generate comprehensive analysis report"""
         report = {
-            'total_fields': len(self.field_stats),
+            'total_fields': len(self.counts),
             'field_analysis': {},
             'html_fields': [],
             'key_sections': [],
             'data_structure': self._build_structure_tree()
         }
         
-        for field, stats in self.field_stats.items():
-            # Convert sets to lists for JSON serialization
+        for field, count in self.counts.items():
+            # Join the stats columns, converting sets to lists for JSON serialization
+            html_tags = self.html_tags.get(field, ())
             field_info = {
-                'occurrences': stats['count'],
-                'max_length': stats['max_length'],
-                'samples': stats['sample_values'][:3],  # Limit samples
-                'is_html': bool(stats['html_tags']),
-                'html_tags': list(stats['html_tags']) if stats['html_tags'] else [],
-                'has_tables': stats['has_tables'],
-                'has_lists': stats['has_lists'],
-                'section_codes': list(stats['section_codes']) if stats['section_codes'] else []
+                'occurrences': count,
+                'max_length': self.max_lengths.get(field, 0),
+                'samples': list(self.sample_values.get(field, ())),  # Capped as collected
+                'is_html': bool(html_tags),
+                'html_tags': list(html_tags),
+                'has_tables': field in self.has_tables,
+                'has_lists': field in self.has_lists,
+                'section_codes': list(self.section_codes.get(field, ()))
             }
             
             report['field_analysis'][field] = field_info
@@ -130,31 +396,19 @@ class FDALabelAnalyzer:
                 report['html_fields'].append(field)
             
             # Identify key medical sections
-            if any(keyword in field.lower() for keyword in 
-                   ['indication', 'dosage', 'warning', 'adverse', 'clinical']):
+            if _KEY_SECTION_RE.search(field):
                 report['key_sections'].append(field)
         
         return report
     
     def _build_structure_tree(self) -> Dict[str, Any]:
         """Build a tree representation of the data structure"""
-        tree = {}
-        for field in self.field_stats.keys():
-            parts = field.split('.')
-            current = tree
-            for part in parts[:-1]:
-                if part not in current:
-                    current[part] = {}
-                current = current[part]
-            
-            # Add field info at leaf
-            leaf_name = parts[-1]
-            current[leaf_name] = {
-                'type': 'html' if self.field_stats[field]['html_tags'] else 'text',
-                'occurrences': self.field_stats[field]['count']
-            }
+        # Add field info at each leaf
+        for field, leaf in self.tree_leaves.items():
+            leaf['type'] = 'html' if field in self.html_tags else 'text'
+            leaf['occurrences'] = self.counts[field]
         
-        return tree
+        return self.tree
     
     def print_summary(self, report: Dict[str, Any]):
         """Print a human-readable summary of the analysis"""
@@ -211,23 +465,32 @@ class FDALabelAnalyzer:
     
     def export_field_summary(self, report: Dict[str, Any], output_file: str = 'fda_label_fields.csv'):
         """Export field analysis to CSV for easy reference"""
-        rows = []
-        for field, info in report['field_analysis'].items():
-            rows.append({
-                'field_path': field,
-                'is_html': info['is_html'],
-                'max_length': info['max_length'],
-                'has_tables': info['has_tables'],
-                'has_lists': info['has_lists'],
-                'html_tags': ', '.join(info['html_tags'][:10]) if info['html_tags'] else '',
-                'sample': info['samples'][0] if info['samples'] else ''
-            })
-        
-        df = pd.DataFrame(rows)
-        df.to_csv(output_file, index=False)
+        with open(output_file, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['field_path', 'is_html', 'max_length', 'has_tables', 'has_lists', 'html_tags', 'sample'])
+            writer.writerows(
+                (
+                    field,
+                    info['is_html'],
+                    info['max_length'],
+                    info['has_tables'],
+                    info['has_lists'],
+                    ', '.join(info['html_tags'][:10]) if info['html_tags'] else '',
+                    info['samples'][0] if info['samples'] else ''
+                )
+                for field, info in report['field_analysis'].items()
+            )
         print(f"\n📄 Field summary exported to: {output_file}")
 
 
+def _analyze_batch(drugs: List[Dict[str, Any]]) -> FDALabelAnalyzer:
+    """Worker entry point: analyze a batch of drugs with a fresh analyzer"""
+    analyzer = FDALabelAnalyzer()
+    for drug in drugs:
+        analyzer._analyze_drug(drug)
+    return analyzer
+
+
 # Example usage
 if __name__ == "__main__":
     # Analyze the FDA label JSON
@@ -243,6 +506,6 @@ if __name__ == "__main__":
     analyzer.export_field_summary(report)
     
     # Save full report as JSON
-    with open('fda_label_analysis_report.json', 'w') as f:
-        json.dump(report, f, indent=2)
+    with open('fda_label_analysis_report.json', 'wb') as f:
+        f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
     print("\n📊 Full analysis report saved to: fda_label_analysis_report.json")
\ No newline at end of file